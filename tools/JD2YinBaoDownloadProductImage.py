@@ -16,60 +16,111 @@
   python JD2YinBaoDownloadProductImage.py --src "../data/导出saas商品详情5549981758728787637.xlsx"
 
 依赖：
-  pip install pandas pillow requests tqdm
+  pip install pandas pillow "httpx[http2]" tqdm
+  pip install python-calamine   # 可选，更快的 Excel 解析
+  pip install pyvips            # 可选，需系统已装 libvips；图片缩放/编码更快
+  pip install mozjpeg-lossless-optimization   # 可选，JPEG 无损再压缩，略超限时免于降质量
+  pip install pyarrow           # 可选，更快写出下载报表
 """
 
 import argparse
+import asyncio
+import importlib.util
 import io
+import itertools
 import os
 import re
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 
+import httpx
 import pandas as pd
-import requests
 from PIL import Image, ImageOps
 from tqdm import tqdm
 
+from _barcode_utils import open_excel, parse_sheet
+
+try:
+    import pyvips  # 可选：libvips 缩放/编码更快
+except (ImportError, OSError):
+    pyvips = None
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv  # 可选：Arrow C++ CSV 写出
+except ImportError:
+    pa = pacsv = None
+
+try:
+    import mozjpeg_lossless_optimization  # 可选：mozjpeg 无损再压缩 JPEG
+except ImportError:
+    mozjpeg_lossless_optimization = None
+
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png"}
 ALLOWED_MIMES = {"image/jpeg", "image/png"}
 
 BARCODE_CANDIDATES = ["条码/简码", "条码", "商品条码", "主编码", "EAN", "UPC", "Barcode"]
 URL_CANDIDATES = ["图片", "商品图片", "商品主图", "图片URL", "图片url", "主图", "图片链接", "图片地址"]
 
+# 预编译的正则（供整列 .str 方法使用）
+_URL_SEP = re.compile(r"[,\s;；\n\r]+")
+_DOT_ZERO = re.compile(r"\.0$")
+_SEP_CN = re.compile(r"[，；、]")
+_SEP_ASCII = re.compile(r"[ ,/|;]+")
+_FNAME_BAD = re.compile(r"[\\/:*?\"<>|]")
+
 def guess_col(df: pd.DataFrame, candidates):
     for name in candidates:
         if name in df.columns:
             return name
     return None
 
-def split_urls(s: str):
-    if not isinstance(s, str):
-        return []
-    return [p for p in re.split(r"[,\s;；\n\r]+", s.strip()) if p]
-
 def ensure_dir(d):
     os.makedirs(d, exist_ok=True)
 
-def sanitize_barcode(bc: str) -> str:
-    """从条码单元格中取第一个条码作为文件名，保留前导零，去掉 .0 尾巴和非法字符。"""
-    if bc is None:
-        return ""
-    s = str(bc).strip()
-    # Excel 数值型导出常见的 1234567890.0 情况
-    s = re.sub(r"\.0$", "", s)
+def image_stem(bc: str, j: int) -> str:
+    """第 1 张图以条码命名，其余为 条码_序号"""
+    return bc if j == 1 else f"{bc}_{j}"
+
+def existing_images(out_dir: str) -> dict:
+    """扫描输出目录一次，返回 {文件名主干: 路径}，只统计非空的图片文件。"""
+    found = {}
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in ALLOWED_EXTS and entry.is_file() and entry.stat().st_size > 0:
+                found.setdefault(stem, entry.path)
+    return found
 
+def vec_sanitize_barcode(series: pd.Series) -> pd.Series:
+    """从条码单元格中取第一个条码作为文件名，保留前导零，去掉 .0 尾巴和非法字符；整列一次处理。"""
+    # Excel 数值型导出常见的 1234567890.0 情况
+    s = series.astype(str).str.strip().str.replace(_DOT_ZERO, "", regex=True)
     # 先统一分隔符（中文逗号/分号等），再按常见分隔符切分，取第一个
-    s_norm = re.sub(r"[，；、]", ",", s)
-    first = re.split(r"[ ,/|;]+", s_norm)[0].strip() if s_norm else ""
+    s = s.str.replace(_SEP_CN, ",", regex=True)
+    first = s.str.split(_SEP_ASCII, regex=True).str[0].fillna("").str.strip()
+    return first.str.replace(_FNAME_BAD, "", regex=True)
+
+def vec_split_urls(series: pd.Series) -> list:
+    """按逗号/空白/分号切分整列图片URL，返回与行对应的 URL 列表。"""
+    parts = series.astype(str).str.strip().str.split(_URL_SEP, regex=True)
+    return [[p for p in lst if p] if isinstance(lst, list) else [] for lst in parts.tolist()]
 
-    # 去除文件名非法字符
-    first = re.sub(r"[\\/:*?\"<>|]", "", first)
-    return first
+def make_client(max_connections=128, timeout=20) -> httpx.AsyncClient:
+    """
+    复用连接的异步客户端：服务端支持 HTTP/2 时多个请求复用同一 TCP 连接；
+    未安装 h2 时退回 HTTP/1.1 连接池。连接失败自动重试。
+    """
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    http2 = importlib.util.find_spec("h2") is not None
+    transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits, retries=3)
+    return httpx.AsyncClient(transport=transport, timeout=timeout, follow_redirects=True)
 
-def fetch_image(url: str, timeout=20):
+async def fetch_image(client: httpx.AsyncClient, url: str):
     try:
-        resp = requests.get(url, timeout=timeout, stream=True)
+        resp = await client.get(url)
         resp.raise_for_status()
         content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
         if content_type == "image/png":
@@ -80,38 +131,208 @@ def fetch_image(url: str, timeout=20):
     except Exception as e:
         return None, None, f"下载失败: {e}"
 
-def process_image(content: bytes, size=750, max_bytes=3*1024*1024, ext=".jpg"):
+def encode_jpeg_within(encode, max_bytes: int, start=85, floor=50, shrink=None):
+    """
+    在不超过 max_bytes 的前提下找尽量高的 JPEG 质量：先试 start，够小再试 start+5；否则向下二分。
+    encode(quality) 返回编码后的 bytes-like；找不到时返回 None。
+    shrink(data) 为可选的无损再压缩：start 略超限时先试一次，能满足就不再降质量；最终结果也会过一遍。
+    """
+    data = encode(start)
+    if len(data) <= max_bytes:
+        higher = encode(start + 5)
+        best = higher if len(higher) <= max_bytes else data
+    else:
+        if shrink is not None:
+            shrunk = shrink(data)
+            if len(shrunk) <= max_bytes:
+                return shrunk
+        lo, hi, best = floor, start - 1, None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            cand = encode(mid)
+            if len(cand) <= max_bytes:
+                best, lo = cand, mid + 1
+            else:
+                hi = mid - 1
+    if best is not None and shrink is not None:
+        best = shrink(best)
+    return best
+
+def _pil_canvas(im: Image.Image, size: int) -> Image.Image:
+    # JPEG 在解码阶段直接按 1/2、1/4、1/8 缩小；留 2 倍余量给后续缩放保证清晰度
+    im.draft("RGB", (size * 2, size * 2))
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGB")
+    im = ImageOps.contain(im, (size, size))
+    canvas = Image.new("RGB", (size, size), (255, 255, 255))
+    x = (size - im.width) // 2
+    y = (size - im.height) // 2
+    canvas.paste(im, (x, y))
+    return canvas
+
+def _pil_encoder(canvas: Image.Image, fmt: str):
+    def encode(quality=None):
+        buf = io.BytesIO()
+        if fmt == "JPEG":
+            canvas.save(buf, format="JPEG", quality=quality, optimize=True)
+        else:
+            canvas.save(buf, format="PNG", optimize=True)
+        return buf.getbuffer()
+    return encode
+
+def _vips_canvas(content, size: int):
+    # thumbnail 在解码时即按目标尺寸缩小（JPEG shrink-on-load），并按顺序流式读取；
+    # no_rotate：与 Pillow 路径一致，不按 EXIF 方向自动旋转
+    img = pyvips.Image.thumbnail_buffer(bytes(content), size, height=size, size="both", no_rotate=True)
+    if img.hasalpha():
+        img = img.extract_band(0, n=img.bands - 1)
+    if img.interpretation != "srgb":
+        img = img.colourspace("srgb")
+    x = (size - img.width) // 2
+    y = (size - img.height) // 2
+    canvas = img.embed(x, y, size, size, extend="background", background=[255, 255, 255])
+    # thumbnail 的流水线只能顺序读一遍，JPEG 质量搜索要编码多次；先落到内存（size×size，很小）
+    return canvas.copy_memory()
+
+def _vips_encoder(canvas, fmt: str):
+    def encode(quality=None):
+        if fmt == "JPEG":
+            return canvas.jpegsave_buffer(Q=quality, optimize_coding=True, strip=True)
+        return canvas.pngsave_buffer(compression=9)
+    return encode
+
+_VIPS_OK = None
+
+def _vips_usable() -> bool:
+    """
+    用一张小图走一遍 libvips 路径并连续编码两次 JPEG；不可用时回退 Pillow，不让整批图片失败。
+    结果按进程缓存。libvips 的线程池在 fork 后的子进程里会死锁，所以只在处理图片的子进程中首次用到时检查，
+    主进程不调用 libvips。
+    """
+    global _VIPS_OK
+    if _VIPS_OK is None:
+        try:
+            sample = pyvips.Image.black(64, 48, bands=3).jpegsave_buffer()
+            encode = _vips_encoder(_vips_canvas(sample, 32), "JPEG")
+            _VIPS_OK = len(encode(85)) > 0 and len(encode(90)) > 0
+        except Exception:
+            _VIPS_OK = False
+    return _VIPS_OK
+
+def _mozjpeg_shrink(data):
+    # mozjpeg 无损再压缩，同一质量下通常再小 5%~10%；偶尔没变小时保留原结果
+    optimized = mozjpeg_lossless_optimization.optimize(bytes(data))
+    return optimized if len(optimized) < len(data) else data
+
+def render_image(src, size=750, max_bytes=3*1024*1024, ext=".jpg"):
+    """
+    缩放、居中贴到白底方图并压缩到 max_bytes 以内。
+    src 可为 bytes 或可读文件对象；返回 (bytes-like, 扩展名, 错误信息)，
+    编码结果以 memoryview 形式直接引用缓冲区，不额外复制。
+    安装了 pyvips 时用 libvips 缩放/编码（更快），否则用 Pillow。
+    """
     try:
-        im = Image.open(io.BytesIO(content))
-        if im.mode not in ("RGB", "RGBA"):
-            im = im.convert("RGB")
-        im = ImageOps.contain(im, (size, size))
-        canvas = Image.new("RGB", (size, size), (255, 255, 255))
-        x = (size - im.width) // 2
-        y = (size - im.height) // 2
-        canvas.paste(im, (x, y))
+        is_bytes = isinstance(src, (bytes, bytearray, memoryview))
+        im = Image.open(io.BytesIO(src) if is_bytes else src)
+        # 已是 size×size 且未超限的 RGB 原图直接返回，省去解码+重新编码（也避免二次压缩损失）
+        fmt_ext = {"JPEG": ".jpg", "PNG": ".png"}.get(im.format)
+        if (is_bytes and im.size == (size, size) and im.mode == "RGB" and len(src) <= max_bytes
+                and ext.lower() in ALLOWED_EXTS and fmt_ext == ext.lower()):
+            return src, fmt_ext, None
+
+        if pyvips is not None and is_bytes and _vips_usable():
+            canvas, make_encoder = _vips_canvas(src, size), _vips_encoder
+        else:
+            canvas, make_encoder = _pil_canvas(im, size), _pil_encoder
 
         out_ext = ext.lower() if ext.lower() in ALLOWED_EXTS else ".jpg"
-        quality = 95
-        while quality >= 50:
-            buf = io.BytesIO()
-            if out_ext in [".jpg", ".jpeg"]:
-                canvas.save(buf, format="JPEG", quality=quality, optimize=True)
-            else:
-                canvas.save(buf, format="PNG", optimize=True)
-                if buf.tell() > max_bytes:
-                    out_ext = ".jpg"
-                    continue
-            if buf.tell() <= max_bytes:
-                return buf.getvalue(), out_ext, None
-            quality -= 5
-        return None, None, "压缩仍超过限制"
+        if out_ext == ".png":
+            data = make_encoder(canvas, "PNG")()
+            if len(data) <= max_bytes:
+                return data, out_ext, None
+            out_ext = ".jpg"
+
+        shrink = _mozjpeg_shrink if mozjpeg_lossless_optimization is not None else None
+        data = encode_jpeg_within(make_encoder(canvas, "JPEG"), max_bytes, shrink=shrink)
+        if data is None:
+            return None, None, "压缩仍超过限制"
+        return data, out_ext, None
     except Exception as e:
         return None, None, f"图片处理失败: {e}"
 
-def save_bytes(data: bytes, path: str):
+def save_bytes(data, path: str):
+    """先写临时文件再原子替换，中断时不会留下半截图片；临时文件名唯一，多进程写同名文件互不干扰。"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def process_and_save(content: bytes, out_stem: str, ext=".jpg", size=750, max_bytes=3*1024*1024):
+    """子进程内处理并直接落盘，只把路径传回主进程；返回 (路径, 错误信息)。"""
+    data, out_ext, err = render_image(content, size=size, max_bytes=max_bytes, ext=ext)
+    if err:
+        return None, err
+    path = f"{out_stem}{out_ext}"
+    try:
+        save_bytes(data, path)
+    except OSError as e:
+        return None, f"保存失败: {e}"
+    return path, None
+
+REPORT_COLUMNS = ["barcode", "url", "status", "info"]
+
+def write_report(report, path: str):
+    """写出 UTF-8 BOM 的 CSV 报表（Excel 直接打开不乱码）；有 pyarrow 时用 Arrow 写出。"""
+    if pacsv is None:
+        pd.DataFrame(report, columns=REPORT_COLUMNS).to_csv(path, index=False, encoding="utf-8-sig")
+        return
+    table = pa.table({col: pa.array([row[k] for row in report], type=pa.string())
+                      for k, col in enumerate(REPORT_COLUMNS)})
     with open(path, "wb") as f:
-        f.write(data)
+        f.write(b"\xef\xbb\xbf")
+        pacsv.write_csv(table, f)
+
+async def download_all(groups, out_dir, concurrency=64, procs=None):
+    """
+    并发下载并在进程池中处理落盘。groups 为同名 (条码, 序号, URL) 任务组的列表：
+    不同组并发执行，同一组内按原顺序依次执行，后成功的覆盖先成功的，失败的不影响已保存的图片。
+    返回与 groups 对应的报表行列表。
+    """
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(max(concurrency, 1))
+    report = [[None] * len(g) for g in groups]
+
+    with ProcessPoolExecutor(max_workers=procs or os.cpu_count()) as proc_pool, \
+            tqdm(total=sum(map(len, groups)), desc="下载中") as bar:
+        async with make_client(max_connections=max(concurrency, 1) * 2) as client:
+            async def one(bc, j, u):
+                # 信号量覆盖下载+处理，限制同时驻留内存的图片数量
+                async with sem:
+                    try:
+                        content, ext, err = await fetch_image(client, u)
+                        if err:
+                            return [bc, u, "fail", err]
+                        out_stem = os.path.join(out_dir, image_stem(bc, j))
+                        path, perr = await loop.run_in_executor(proc_pool, process_and_save, content, out_stem, ext)
+                        return [bc, u, "fail", perr] if perr else [bc, u, "ok", path]
+                    except Exception as e:
+                        # 单张图片出错（含子进程崩溃 BrokenProcessPool）只记为失败，不中断整批
+                        return [bc, u, "fail", f"图片处理失败: {e}"]
+                    finally:
+                        bar.update(1)
+
+            async def run_group(g):
+                for k, task in enumerate(groups[g]):
+                    report[g][k] = await one(*task)
+
+            await asyncio.gather(*(run_group(g) for g in range(len(groups))))
+    return report
 
 def main():
     parser = argparse.ArgumentParser()
@@ -119,13 +340,16 @@ def main():
     parser.add_argument("--out_dir", default="../data/images", help="输出图片目录（默认 ../data/images）")
     parser.add_argument("--barcode_col", default=None, help="条码列名")
     parser.add_argument("--url_col", default=None, help="图片URL列名")
+    parser.add_argument("--workers", type=int, default=64, help="同时进行的下载数（默认 64）")
+    parser.add_argument("--procs", type=int, default=None, help="图片处理进程数（默认 CPU 核数）")
+    parser.add_argument("--overwrite", action="store_true", help="重新下载已存在的图片（默认跳过）")
     args = parser.parse_args()
 
     if args.src.lower().endswith(".csv"):
         df = pd.read_csv(args.src)
     else:
-        xls = pd.ExcelFile(args.src)
-        df = pd.read_excel(xls, sheet_name=xls.sheet_names[0])
+        xls = open_excel(args.src)
+        df = parse_sheet(xls, xls.sheet_names[0])
 
     bc_col = args.barcode_col or guess_col(df, BARCODE_CANDIDATES)
     url_col = args.url_col or guess_col(df, URL_CANDIDATES)
@@ -135,28 +359,41 @@ def main():
 
     ensure_dir(args.out_dir)
 
-    report = []
-    for idx in tqdm(range(len(df)), desc="下载中"):
-        bc = sanitize_barcode(df.iloc[idx][bc_col])
-        urls = split_urls(str(df.iloc[idx][url_col]))
-        if not bc or not urls:
-            continue
-        for j, u in enumerate(urls, start=1):
-            content, ext, err = fetch_image(u)
-            if err:
-                report.append([bc, u, "fail", err])
-                continue
-            processed, out_ext, perr = process_image(content, ext=ext)
-            if perr:
-                report.append([bc, u, "fail", perr])
-                continue
-            fn = f"{bc}{out_ext}" if j == 1 else f"{bc}_{j}{out_ext}"
-            path = os.path.join(args.out_dir, fn)
-            save_bytes(processed, path)
-            report.append([bc, u, "ok", path])
+    # 一次性展开为 (条码, 序号, URL) 任务列表
+    bcs = vec_sanitize_barcode(df[bc_col]).tolist()
+    url_lists = vec_split_urls(df[url_col])
+    tasks = list(itertools.chain.from_iterable(
+        ((bc, j, u) for j, u in enumerate(urls, start=1))
+        for bc, urls in zip(bcs, url_lists) if bc and urls
+    ))
+
+    # 同名任务（重复条码等）归为一组，组内按原顺序执行，结果与逐个覆盖写入一致
+    groups = {}
+    for i, (bc, j, _) in enumerate(tasks):
+        groups.setdefault(image_stem(bc, j), []).append(i)
+
+    # 断点续跑：输出目录中已有同名图片的任务直接跳过
+    done = {} if args.overwrite else existing_images(args.out_dir)
+    report = [None] * len(tasks)
+    todo = []
+    for stem, idxs in groups.items():
+        if stem in done:
+            for i in idxs:
+                report[i] = [tasks[i][0], tasks[i][2], "skip", done[stem]]
+        else:
+            todo.append(idxs)
+    skipped = len(tasks) - sum(map(len, todo))
+    if skipped:
+        print(f"跳过已存在的图片 {skipped} 张（--overwrite 可强制重新下载）")
+
+    results = asyncio.run(download_all([[tasks[i] for i in idxs] for idxs in todo], args.out_dir,
+                                       concurrency=args.workers, procs=args.procs))
+    for idxs, rows in zip(todo, results):
+        for i, row in zip(idxs, rows):
+            report[i] = row
 
     rep_path = os.path.join(args.out_dir, "download_report.csv")
-    pd.DataFrame(report, columns=["barcode", "url", "status", "info"]).to_csv(rep_path, index=False, encoding="utf-8-sig")
+    write_report(report, rep_path)
     print(f"\n完成 ✅ 图片目录: {args.out_dir}\n报表: {rep_path}")
 
 if __name__ == "__main__":
@@ -14,55 +14,16 @@ JD2YinBaoPackageRelation.py
 
 依赖：
   pip install pandas openpyxl
+  pip install python-calamine   # 可选，更快的 Excel 解析
+  pip install xlsxwriter        # 可选，更快的 Excel 写出
 """
 
 import argparse
 import os
-import re
 from typing import List, Set, Tuple
 import pandas as pd
 
-# 允许的分隔符（多条码情况下取第一个）
-SEPS = [",", "，", ";", "；", " ", "\n", "\t", "/", "／", "|", "丨"]
-
-
-def first_token(s: str) -> str:
-    """按常见分隔符切分，取第一个非空 token"""
-    if s is None:
-        return ""
-    s = str(s).strip()
-    if not s:
-        return ""
-    for sep in SEPS:
-        if sep in s:
-            parts = [p.strip() for p in s.split(sep) if p.strip()]
-            return parts[0] if parts else ""
-    return s
-
-
-def sanitize_barcode(raw) -> str:
-    """
-    清洗为条码字符串：
-      - 先取第一个 token
-      - 去尾部 .0
-      - 若含非数字，尝试提取第一个 6 位以上数字串；失败则仅保留所有数字
-    """
-    if pd.isna(raw):
-        return ""
-    s = first_token(str(raw))
-
-    if s.endswith(".0"):
-        s = s[:-2]
-
-    if not s.isdigit():
-        m = re.search(r"\d{6,}", s)
-        if m:
-            s = m.group(0)
-        else:
-            s = "".join(re.findall(r"\d", s))
-
-    s = re.sub(r"\D", "", s)
-    return s
+from _barcode_utils import excel_writer, open_excel, parse_sheet, vec_sanitize_barcode
 
 
 def to_int(n):
@@ -75,6 +36,18 @@ def to_int(n):
         return None
 
 
+def vec_to_int(series: pd.Series) -> pd.Series:
+    """to_int 的整列版本，无法转换的为缺失值（Int64）"""
+    num = pd.to_numeric(series, errors="coerce").astype("float64")
+    # pd.to_numeric 不认的写法（全角数字“１２”等）逐个交给 to_int，与逐行版本一致
+    retry = num.isna() & series.notna()
+    if retry.any():
+        num[retry] = series[retry].map(to_int).astype("float64")
+    # inf 及超出 Int64 范围的数量按无法转换处理
+    num = num.round()
+    return num.where(num.abs() < 2**63).astype("Int64")
+
+
 def load_relations(
     src_file: str,
     sheet_name: str = "Sheet1",
@@ -90,54 +63,53 @@ def load_relations(
         "单品条形码*": "string",
     }
 
-    df = pd.read_excel(
-        src_file,
-        sheet_name=sheet_name,
+    df = parse_sheet(
+        open_excel(src_file),
+        sheet_name,
         header=header_row,
         dtype=dtype_map,
-        engine="openpyxl",
     )
 
     for col in ["箱品条形码*", "单品条形码*", "箱品内装数*"]:
         if col not in df.columns:
             raise ValueError(f"缺少必需列：{col}（请确认表头行 header={header_row+1} 与列名一致）")
 
-    records = []
-
-    for _, row in df.iterrows():
-        box_code = sanitize_barcode(row.get("箱品条形码*"))
-        single_code = sanitize_barcode(row.get("单品条形码*"))
-        box_qty = to_int(row.get("箱品内装数*"))
-
-        mid_code = sanitize_barcode(row.get("中品条形码")) if "中品条形码" in df.columns else ""
-        mid_qty = to_int(row.get("中品内装数")) if "中品内装数" in df.columns else None
-
-        # 有中品：先 箱→中 用“箱品内装数*”；再 中→单 用“中品内装数”
-        if mid_code and (box_qty is not None and box_qty > 0):
-            records.append({
-                "大件商品条码": box_code,
-                "小件商品条码": mid_code,
-                "换算关系": box_qty,
-                "示例": f"{box_code} = {mid_code} * {box_qty}",
-            })
-            if single_code and (mid_qty is not None and mid_qty > 0):
-                records.append({
-                    "大件商品条码": mid_code,
-                    "小件商品条码": single_code,
-                    "换算关系": mid_qty,
-                    "示例": f"{mid_code} = {single_code} * {mid_qty}",
-                })
-
-        # 无中品：直接 箱→单 用“箱品内装数*”
-        elif box_code and single_code and (box_qty is not None and box_qty > 0):
-            records.append({
-                "大件商品条码": box_code,
-                "小件商品条码": single_code,
-                "换算关系": box_qty,
-                "示例": f"{box_code} = {single_code} * {box_qty}",
-            })
-
-    return pd.DataFrame(records, columns=["大件商品条码", "小件商品条码", "换算关系", "示例"])
+    box_code = vec_sanitize_barcode(df["箱品条形码*"])
+    single_code = vec_sanitize_barcode(df["单品条形码*"])
+    mid_code = (vec_sanitize_barcode(df["中品条形码"])
+                if "中品条形码" in df.columns else pd.Series("", index=df.index, dtype=object))
+    box_qty = vec_to_int(df["箱品内装数*"])
+    mid_qty = (vec_to_int(df["中品内装数"])
+               if "中品内装数" in df.columns else pd.Series(pd.NA, index=df.index, dtype="Int64"))
+
+    box_qty_ok = box_qty.gt(0).fillna(False).astype(bool)
+    mid_qty_ok = mid_qty.gt(0).fillna(False).astype(bool)
+
+    # 有中品：先 箱→中 用“箱品内装数*”；再 中→单 用“中品内装数”
+    has_mid = mid_code.ne("") & box_qty_ok
+    mid_to_single = has_mid & single_code.ne("") & mid_qty_ok
+    # 无中品：直接 箱→单 用“箱品内装数*”
+    no_mid = ~has_mid & box_code.ne("") & single_code.ne("") & box_qty_ok
+
+    def relation_frame(mask, big, small, qty, stage):
+        qty = qty[mask].astype("int64")
+        part = pd.DataFrame({
+            "大件商品条码": big[mask],
+            "小件商品条码": small[mask],
+            "换算关系": qty,
+        })
+        part["示例"] = part["大件商品条码"] + " = " + part["小件商品条码"] + " * " + qty.astype(str)
+        part["_stage"] = stage
+        return part
+
+    rel = pd.concat([
+        relation_frame(has_mid, box_code, mid_code, box_qty, 0),
+        relation_frame(mid_to_single, mid_code, single_code, mid_qty, 1),
+        relation_frame(no_mid, box_code, single_code, box_qty, 0),
+    ])
+    # 按原始行顺序输出，同一行内 箱→中 在 中→单 之前
+    rel = rel.rename_axis("_row").sort_values(["_row", "_stage"], kind="stable")
+    return rel.reset_index(drop=True)[["大件商品条码", "小件商品条码", "换算关系", "示例"]]
 
 
 # -------------------- 校验（可选） --------------------
@@ -149,14 +121,20 @@ PRODUCT_BARCODE_CANDIDATES = [
 
 def collect_product_barcodes(product_file: str) -> Set[str]:
     """从商品资料文件中收集所有条码（多列&多条码取第一个），返回集合"""
-    xl = pd.ExcelFile(product_file, engine="openpyxl")
+    xl = open_excel(product_file)
     frames: List[pd.DataFrame] = []
     for sheet in xl.sheet_names:
         try:
-            df = pd.read_excel(product_file, sheet_name=sheet, dtype="string", engine="openpyxl")
+            # 只读取候选条码列；没有候选列的工作表直接跳过
+            header = parse_sheet(xl, sheet, nrows=0).columns
+            usecols = [i for i, c in enumerate(header) if c in PRODUCT_BARCODE_CANDIDATES]
+            if not usecols:
+                continue
+            df = parse_sheet(xl, sheet, dtype="string", usecols=usecols)
             frames.append(df)
-        except Exception:
-            pass
+        except Exception as e:
+            # 跳过的工作表中的条码都会被当成“缺失”，必须提示
+            print(f"⚠️ 商品资料工作表「{sheet}」读取失败，已跳过（其中条码不计入商品库）：{e}")
     if not frames:
         return set()
 
@@ -164,10 +142,8 @@ def collect_product_barcodes(product_file: str) -> Set[str]:
     codes = set()
     for col in PRODUCT_BARCODE_CANDIDATES:
         if col in merged.columns:
-            for v in merged[col].astype("string").fillna(""):
-                code = sanitize_barcode(v)
-                if code:
-                    codes.add(code)
+            codes.update(vec_sanitize_barcode(merged[col]))
+    codes.discard("")
     return codes
 
 
@@ -187,7 +163,7 @@ def validate_relations(df_rel: pd.DataFrame, product_codes: Set[str]) -> Tuple[S
 
 def save_missing_report(missing_large: Set[str], missing_small: Set[str], path: str):
     """将缺失条码清单存为 Excel（两个sheet）"""
-    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+    with excel_writer(path) as writer:
         pd.DataFrame(sorted(missing_large), columns=["缺失大件商品条码"]).to_excel(writer, index=False, sheet_name="缺失大件条码")
         pd.DataFrame(sorted(missing_small), columns=["缺失小件商品条码"]).to_excel(writer, index=False, sheet_name="缺失小件条码")
 
@@ -211,7 +187,8 @@ def main():
 
     # 输出关系表
     out_file = args.out or f"{os.path.splitext(args.src)[0]}_converted.xlsx"
-    df_rel.to_excel(out_file, index=False)
+    with excel_writer(out_file) as writer:
+        df_rel.to_excel(writer, index=False)
     print(f"✅ 已生成关系表：{out_file}（{len(df_rel)} 条）")
 
     # 可选：校验商品库
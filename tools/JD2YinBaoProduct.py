@@ -19,17 +19,19 @@
         --out_prefix "商品导入模版_清洗输出" \
         --max_rows 1500
 
-依赖：pandas, openpyxl
+依赖：pandas, openpyxl（可选 python-calamine 解析更快，可选 xlsxwriter 写出更快）
 """
 
 import argparse
 import math
 import re
-from typing import List, Optional
+from typing import List
 
 import numpy as np
 import pandas as pd
 
+from _barcode_utils import excel_writer, open_excel, parse_sheet
+
 
 def pick(frame: pd.DataFrame, *names: List[str]) -> pd.Series:
     for n in names:
@@ -42,66 +44,67 @@ def to_num(s: pd.Series) -> pd.Series:
     return pd.to_numeric(s, errors="coerce")
 
 
-def extract_spec_from_name(name: str) -> str:
-    """从名称中提取规格信息（优先多包装，其次单规格，再数量单位）"""
-    if not isinstance(name, str):
-        return ""
+# 规格识别模式，按优先级排列：多包装 > 单规格 > 数量单位
+SPEC_PATTERNS = [
     # 12*500ml / 500ml*12
-    m = re.findall(r"(\d+\s*[x×*]\s*\d+\s*(?:ml|mL|ML|l|L|g|G|kg|KG|片|粒|瓶|听|罐|袋|包|盒))", name, flags=re.IGNORECASE)
-    if m:
-        return m[0].replace(" ", "")
+    r"(\d+\s*[x×*]\s*\d+\s*(?:ml|mL|ML|l|L|g|G|kg|KG|片|粒|瓶|听|罐|袋|包|盒))",
     # 500ml / 2L / 30g
-    m2 = re.findall(r"(\d+(?:\.\d+)?\s*(?:ml|mL|ML|l|L|g|G|kg|KG|片|粒|瓶|听|罐|袋|包|盒))", name, flags=re.IGNORECASE)
-    if m2:
-        return m2[0].replace(" ", "")
+    r"(\d+(?:\.\d+)?\s*(?:ml|mL|ML|l|L|g|G|kg|KG|片|粒|瓶|听|罐|袋|包|盒))",
     # 12瓶 / 24听
-    m3 = re.findall(r"(\d+\s*(?:瓶|听|罐|袋|包|盒|片|粒))", name, flags=re.IGNORECASE)
-    if m3:
-        return m3[0].replace(" ", "")
-    return ""
-
-
-def parse_weight_from_spec(spec_text: str) -> Optional[float]:
-    """从规格中解析 g/kg 重量，返回克(g)。解析不到返回 None。"""
-    if not isinstance(spec_text, str):
-        return None
-    m = re.search(r"(\d+(?:\.\d+)?)\s*(kg|KG|千克|公斤|g|G|克)", spec_text)
-    if not m:
-        return None
-    val = float(m.group(1))
-    unit = m.group(2).lower()
-    grams = None
-    if unit in ["kg", "千克", "公斤"]:
-        grams = val * 1000
-    elif unit in ["g", "克"]:
-        grams = val
-    if grams is not None and grams > 0:
-        return round(grams, 2)
-    return None
+    r"(\d+\s*(?:瓶|听|罐|袋|包|盒|片|粒))",
+]
+
+
+def vec_extract_spec_from_name(names: pd.Series) -> pd.Series:
+    """从名称中提取规格信息（优先多包装，其次单规格，再数量单位）；每个模式整列匹配一次，按优先级合并"""
+    names = names.astype(str)
+    spec = pd.Series(np.nan, index=names.index, dtype=object)
+    for pat in SPEC_PATTERNS:
+        spec = spec.fillna(names.str.extract(pat, flags=re.IGNORECASE, expand=False))
+    return spec.fillna("").str.replace(" ", "", regex=False)
+
+
+WEIGHT_PATTERN = r"(\d+(?:\.\d+)?)\s*(kg|KG|千克|公斤|g|G|克)"
+KG_UNITS = ["kg", "千克", "公斤"]
+
+
+def vec_parse_weight_from_spec(spec: pd.Series) -> pd.Series:
+    """从规格中解析 g/kg 重量，返回克(g)；解析不到或非正数为 NaN"""
+    m = spec.astype(str).str.extract(WEIGHT_PATTERN)
+    val = pd.to_numeric(m[0], errors="coerce")
+    mult = np.where(m[1].str.lower().isin(KG_UNITS), 1000.0, 1.0)
+    grams = (val * mult).round(2)
+    return grams.where(grams > 0)
+
+
+# main 中 pick(...) 可能用到的全部源列；其余列不读入
+NEEDED_COLUMNS = {
+    "商品名称", "名称", "条码/简码", "条码", "商品条码", "售卖方式", "销售单位", "主单位", "单位",
+    "规格", "规格.1", "平均进货价", "进货价", "门店零售价(元)", "销售价", "零售价",
+    "门店会员价(元)", "会员价", "商品品牌", "品牌", "供应商", "供货商", "毛重", "毛重.1",
+    "库存", "库存量", "店内末级品类", "系统末级品类", "分类", "商品类型", "类型",
+    "上架状态", "商品状态", "是否参与积分", "货号",
+}
 
 
 def main(src: str, out_prefix: str, max_rows: int = 1500):
-    xls_src = pd.ExcelFile(src)
-    df_src = pd.read_excel(src, sheet_name=xls_src.sheet_names[0])
+    xls_src = open_excel(src)
+    sheet = xls_src.sheet_names[0]
+    # 先只读表头，再按列位置读取需要的列（按位置而非列名，兼容 规格/规格.1 这类重名列）
+    header = parse_sheet(xls_src, sheet, nrows=0).columns
+    usecols = [i for i, c in enumerate(header) if c in NEEDED_COLUMNS]
+    df_src = parse_sheet(xls_src, sheet, usecols=usecols or None)
 
     # -------- 条码 & 扩展条码 --------
     barcode_raw = pick(df_src, "条码/简码", "条码", "商品条码").astype(str).str.replace(r"\.0$", "", regex=True)
     splits = barcode_raw.str.split(r"[ ,/|；;]")
     barcode_main = splits.str[0].fillna("")
-    # 剩余条码去空、去重、去与主条码相同
-    def rest_barcodes(lst, main):
-        if not isinstance(lst, list) or len(lst) <= 1:
-            return np.nan
-        cleaned = []
-        seen = set()
-        for x in lst[1:]:
-            v = str(x).strip()
-            if not v or v == main or v in seen:
-                continue
-            seen.add(v)
-            cleaned.append(v)
-        return ",".join(cleaned) if cleaned else np.nan
-    barcode_ext = [rest_barcodes(lst, main) for lst, main in zip(splits, barcode_main)]
+    # 剩余条码去空、去重、去与主条码相同（展开为长表后整列过滤，再按行拼回）
+    rest = splits.str[1:].explode().dropna().str.strip().rename_axis("_row").rename("code").to_frame()
+    rest["main"] = barcode_main.loc[rest.index].values
+    rest = rest[rest["code"].ne("") & rest["code"].ne(rest["main"])]
+    rest = rest.reset_index().drop_duplicates(["_row", "code"])
+    barcode_ext = rest.groupby("_row", sort=False)["code"].agg(",".join).reindex(barcode_main.index)
 
     # -------- 基础映射 --------
     sell_mode = pick(df_src, "售卖方式").astype(str)
@@ -123,22 +126,11 @@ def main(src: str, out_prefix: str, max_rows: int = 1500):
     goods_type = pick(df_src, "商品类型", "类型").fillna("")
 
     status_raw = pick(df_src, "上架状态", "商品状态").astype(str)
-    enable_keys = ["上架", "在架", "销售中", "启用", "可售", "有效"]
+    # 命中任一禁用关键字即“禁用”，其余（含启用类关键字与未知状态）均为“启用”
     disable_keys = ["下架", "停售", "禁用", "停用", "不可售", "无效"]
-    status_std = []
-    for v in status_raw.fillna("").tolist():
-        s = "启用"
-        for k in disable_keys:
-            if k in v:
-                s = "禁用"
-                break
-        else:
-            for k in enable_keys:
-                if k in v:
-                    s = "启用"
-                    break
-        status_std.append(s)
-    status = pd.Series(status_std)
+    disable_re = "|".join(map(re.escape, disable_keys))
+    is_disable = status_raw.fillna("").str.contains(disable_re, regex=True)
+    status = pd.Series(np.where(is_disable, "禁用", "启用"), index=status_raw.index)
 
     points = pick(df_src, "是否参与积分").map(lambda x: "是" if str(x) in ["1", "是", "true", "True", "Y", "参加", "参与"] else ("否" if pd.notna(x) else np.nan))
     sku_no = pick(df_src, "货号")
@@ -147,7 +139,7 @@ def main(src: str, out_prefix: str, max_rows: int = 1500):
         "名称（必填）": pick(df_src, "商品名称", "名称"),
         "分类（必填）": category,
         "条码": barcode_main,
-        "扩展条码": pd.Series(barcode_ext),
+        "扩展条码": barcode_ext,
         "主编码": barcode_main,
         "规格": spec.astype(str),
         "主单位": unit,
@@ -187,40 +179,27 @@ def main(src: str, out_prefix: str, max_rows: int = 1500):
     type_series = goods_type.fillna("").astype(str)
     need_fill = (out["主编码"].notna() & (out["主编码"].astype(str).str.strip()!="")) & (
         out["规格"].isna() | (out["规格"].astype(str).str.lower().isin(["nan",""])))
-    name_spec = name_series.astype(str).map(extract_spec_from_name)
-
-    filled_spec = []
-    for i in range(len(out)):
-        if need_fill.iloc[i]:
-            cand1 = name_spec.iloc[i]
-            cand2 = type_series.iloc[i]
-            if cand1 and cand2:
-                cand = f"{cand2} {cand1}"
-            elif cand1:
-                cand = cand1
-            elif cand2:
-                cand = cand2
-            else:
-                nm = str(name_series.iloc[i])
-                cand = nm[:12] if nm else "通用"
-            filled_spec.append(cand)
-        else:
-            filled_spec.append(out["规格"].iloc[i])
-    out.loc[need_fill, "规格"] = pd.Series(filled_spec)[need_fill.index[need_fill]]
+
+    # 规格候选：名称提取的规格 / 商品类型，二者都有时组合为“类型 规格”，都没有则取名称前12字
+    spec_name = vec_extract_spec_from_name(name_series[need_fill])
+    spec_type = type_series[need_fill]
+    name_head = name_series[need_fill].astype(str).str.slice(0, 12)
+    fallback = name_head.where(name_head.ne(""), "通用")
+    has_name, has_type = spec_name.ne(""), spec_type.ne("")
+    cand = np.where(has_name & has_type, spec_type + " " + spec_name,
+                    np.where(has_name, spec_name,
+                             np.where(has_type, spec_type, fallback)))
+    out.loc[need_fill, "规格"] = cand
 
     # -------- 品牌 限制30字符 & 清理 --------
     out["品牌"] = out["品牌"].astype(str).apply(lambda s: s[:30] if isinstance(s, str) else s)
     out["品牌"] = out["品牌"].replace({"nan": np.nan, "NaN": np.nan, "None": np.nan, "": np.nan})
 
     # -------- 重量：正数约束 & 规格解析 --------
-    fixed_weight = []
-    for i, w in enumerate(out["重量"]):
-        if pd.isna(w) or (isinstance(w, (int, float)) and w <= 0):
-            grams = parse_weight_from_spec(out["规格"].iloc[i])
-            fixed_weight.append(grams if grams is not None and grams > 0 else np.nan)
-        else:
-            fixed_weight.append(w)
-    out["重量"] = pd.to_numeric(pd.Series(fixed_weight), errors="coerce")
+    weight = pd.to_numeric(out["重量"], errors="coerce")
+    needs_fix = weight.isna() | (weight <= 0)
+    grams = vec_parse_weight_from_spec(out.loc[needs_fix, "规格"])
+    out["重量"] = weight.mask(needs_fix, grams)
 
     # -------- 基础清洗 --------
     out = out[~out["名称（必填）"].isna() & ~out["分类（必填）"].isna()].copy()
@@ -236,7 +215,7 @@ def main(src: str, out_prefix: str, max_rows: int = 1500):
         end = min((i + 1) * max_rows, n)
         part = out.iloc[start:end].copy()
         path = f"{out_prefix}_part{i+1}.xlsx"
-        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        with excel_writer(path) as writer:
             part.to_excel(writer, sheet_name="导入模版", index=False)
         paths.append(path)
 
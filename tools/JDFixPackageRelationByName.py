@@ -10,10 +10,11 @@ JDFixPackageRelationByName.py  (keep header layout)
 
 import argparse
 import os
-import re
 from typing import Dict, List, Tuple, Set
 import pandas as pd
 
+from _barcode_utils import excel_writer, open_excel, parse_sheet, sanitize_barcode, vec_normalize_name, vec_sanitize_barcode
+
 # ==== 可调参数 ====
 NAME_CANDIDATES = [
     "商品名称", "品名", "名称", "商品全名", "商品名",
@@ -30,30 +31,6 @@ RELATION_FIELDS = [
     ("中品名称（可不填）", "中品条形码"),
     ("单品名称（可不填）", "单品条形码*"),
 ]
-SEPS = [",", "，", ";", "；", " ", "\n", "\t", "/", "／", "|", "丨"]
-
-def first_token(s: str) -> str:
-    if s is None: return ""
-    s = str(s).strip()
-    if not s: return ""
-    for sep in SEPS:
-        if sep in s:
-            parts = [p.strip() for p in s.split(sep) if p.strip()]
-            return parts[0] if parts else ""
-    return s
-
-def sanitize_barcode(raw) -> str:
-    if pd.isna(raw): return ""
-    s = first_token(str(raw))
-    if s.endswith(".0"): s = s[:-2]
-    if not s.isdigit():
-        m = re.search(r"\d{6,}", s)
-        s = m.group(0) if m else "".join(re.findall(r"\d", s))
-    return re.sub(r"\D", "", s)
-
-def normalize_name(x) -> str:
-    if pd.isna(x): return ""
-    return re.sub(r"\s+", " ", str(x).strip())
 
 def pick_preferred_barcode(codes: List[str]) -> str:
     cleaned = [sanitize_barcode(c) for c in codes if sanitize_barcode(c)]
@@ -64,34 +41,42 @@ def pick_preferred_barcode(codes: List[str]) -> str:
     return cleaned[0]
 
 def load_product_name_to_barcode(products_path: str) -> Tuple[Dict[str, str], Set[str]]:
-    xl = pd.ExcelFile(products_path, engine="openpyxl")
-    name_to_codes: Dict[str, List[str]] = {}
-    all_codes: Set[str] = set()
+    xl = open_excel(products_path)
+    pairs: List[pd.DataFrame] = []
     for sheet in xl.sheet_names:
+        # 复用已打开的工作簿；按字符串解析，避免长条码先变成 float 丢精度
+        # parse_sheet 已包含 calamine → openpyxl 的回退；仍失败才放弃字符串类型
         try:
-            df = pd.read_excel(products_path, sheet_name=sheet, dtype="string", engine="openpyxl")
+            df = parse_sheet(xl, sheet, dtype="string")
         except Exception:
-            df = pd.read_excel(products_path, sheet_name=sheet, engine="openpyxl")
+            df = parse_sheet(xl, sheet)
         name_cols = [c for c in NAME_CANDIDATES if c in df.columns]
         code_cols = [c for c in BARCODE_CANDIDATES if c in df.columns]
         if not name_cols or not code_cols: continue
-        name_col = name_cols[0]
-        for _, row in df.iterrows():
-            name = normalize_name(row.get(name_col))
-            if not name: continue
-            for ccol in code_cols:
-                bc = sanitize_barcode(row.get(ccol))
-                if bc:
-                    all_codes.add(bc)
-                    name_to_codes.setdefault(name, []).append(bc)
-    name_to_barcode = {n: pick_preferred_barcode(cs) for n, cs in name_to_codes.items()}
+        names = vec_normalize_name(df[name_cols[0]])
+        rows = range(len(df))
+        sheet_pairs = pd.concat(
+            [pd.DataFrame({"name": names.values, "code": vec_sanitize_barcode(df[ccol]).values,
+                           "_row": rows, "_col": k})
+             for k, ccol in enumerate(code_cols)],
+            ignore_index=True,
+        )
+        # 保持逐行、逐列的条码顺序（影响 pick_preferred_barcode 的取值）
+        sheet_pairs = sheet_pairs.sort_values(["_row", "_col"], kind="stable")
+        pairs.append(sheet_pairs[sheet_pairs["name"].ne("") & sheet_pairs["code"].ne("")])
+    if not pairs: return {}, set()
+    combined = pd.concat(pairs, ignore_index=True)
+    grouped = combined.groupby("name", sort=False)["code"].apply(list)
+    name_to_barcode = grouped.map(pick_preferred_barcode).to_dict()
+    all_codes = set(combined["code"].unique())
     return name_to_barcode, all_codes
 
 def read_relation(path: str, sheet: str = "Sheet1", header_row: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
     # 读标准数据（带表头）
-    df_rel = pd.read_excel(path, sheet_name=sheet, header=header_row, dtype="string", engine="openpyxl")
+    xl = open_excel(path)
+    df_rel = parse_sheet(xl, sheet, header=header_row, dtype="string")
     # 读原始行，保留表头之前内容
-    raw = pd.read_excel(path, sheet_name=sheet, header=None, dtype="string", engine="openpyxl")
+    raw = parse_sheet(xl, sheet, header=None, dtype="string")
     if header_row > 0 and not raw.empty:
         ncols = len(df_rel.columns)
         df_prefix = raw.iloc[:header_row, :ncols].copy()
@@ -102,29 +87,34 @@ def read_relation(path: str, sheet: str = "Sheet1", header_row: int = 1) -> Tupl
 
 def fix_relation_barcodes(df_rel: pd.DataFrame, name_to_barcode: Dict[str, str], all_product_codes: Set[str]):
     df_new = df_rel.copy()
-    logs: List[dict] = []
-    for idx, row in df_rel.iterrows():
-        for name_col, code_col in RELATION_FIELDS:
-            if name_col not in df_rel.columns or code_col not in df_rel.columns: continue
-            name = normalize_name(row.get(name_col))
-            code = sanitize_barcode(row.get(code_col))
-            needs_fix = (not code) or (code not in all_product_codes) or code.startswith("205")
-            if needs_fix and name:
-                new_code = name_to_barcode.get(name, "")
-                if new_code and new_code != code:
-                    df_new.at[idx, code_col] = new_code
-                    logs.append({
-                        "row_index": int(idx),
-                        "字段": f"{name_col} -> {code_col}",
-                        "商品名称": name,
-                        "原条码": code,
-                        "新条码": new_code,
-                        "原因": "按名称在商品库匹配后回填"
-                    })
-    return df_new, logs
+    log_cols = ["row_index", "字段", "商品名称", "原条码", "新条码", "原因"]
+    log_parts: List[pd.DataFrame] = []
+    valid_fields = [(nc, cc) for nc, cc in RELATION_FIELDS if nc in df_rel.columns and cc in df_rel.columns]
+    for k, (name_col, code_col) in enumerate(valid_fields):
+        names = vec_normalize_name(df_rel[name_col])
+        codes = vec_sanitize_barcode(df_rel[code_col])
+        needs_fix = codes.eq("") | ~codes.isin(all_product_codes) | codes.str.startswith("205")
+        new_codes = names.map(name_to_barcode).fillna("")
+        mask = needs_fix & names.ne("") & new_codes.ne("") & new_codes.ne(codes)
+        if not mask.any(): continue
+        df_new.loc[mask, code_col] = new_codes[mask]
+        log_parts.append(pd.DataFrame({
+            "row_index": df_rel.index[mask.values].astype(int),
+            "字段": f"{name_col} -> {code_col}",
+            "商品名称": names[mask].values,
+            "原条码": codes[mask].values,
+            "新条码": new_codes[mask].values,
+            "原因": "按名称在商品库匹配后回填",
+            "_field": k,
+        }))
+    if not log_parts:
+        return df_new, []
+    # 日志按 行 → 字段 顺序排列
+    df_log = pd.concat(log_parts, ignore_index=True).sort_values(["row_index", "_field"], kind="stable")
+    return df_new, df_log[log_cols].to_dict("records")
 
 def write_fixed_with_preserved_header(out_path: str, df_fixed: pd.DataFrame, df_prefix: pd.DataFrame, sheet_name: str):
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+    with excel_writer(out_path) as writer:
         start_row = 0
         if not df_prefix.empty:
             df_prefix.to_excel(writer, index=False, header=False, sheet_name=sheet_name, startrow=start_row)
@@ -156,10 +146,9 @@ def main():
         df_log = pd.DataFrame(logs, columns=["row_index", "字段", "商品名称", "原条码", "新条码", "原因"])
     else:
         df_log = pd.DataFrame(columns=["row_index", "字段", "商品名称", "原条码", "新条码", "原因"])
-    with pd.ExcelWriter(log_path, engine="openpyxl") as writer:
+    with excel_writer(log_path) as writer:
         df_log.to_excel(writer, index=False, sheet_name="修复日志")
-        snap_map = pd.DataFrame(sorted([(k, v) for k, v in load_product_name_to_barcode(args.products)[0].items()]),
-                                columns=["商品名称", "条码"])
+        snap_map = pd.DataFrame(sorted(name_to_barcode.items()), columns=["商品名称", "条码"])
         snap_map.to_excel(writer, index=False, sheet_name="名称→条码映射快照")
 
     print(f"✅ 修复完成（保持表头行位置）：{out_path}")
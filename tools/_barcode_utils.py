@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+_barcode_utils.py
+
+各脚本共用的辅助函数：
+  - first_token / sanitize_barcode：单个值版本
+  - vec_sanitize_barcode / vec_normalize_name：整列版本，条码清洗结果与单值版本一致
+  - open_excel / parse_sheet：读取工作簿，优先 calamine，解析失败回退 openpyxl
+  - excel_writer：写出工作簿，优先 xlsxwriter
+
+整列版本按 pandas 的 string 类型处理，缺失值统一为空串；
+正则与单值版本共用同一份预编译模式（\\s、\\D 按 Unicode 语义匹配），保证结果一致。
+
+依赖：
+  pip install pandas openpyxl
+  pip install python-calamine   # 可选，更快的 Excel 解析
+  pip install xlsxwriter        # 可选，更快的 Excel 写出
+"""
+
+import re
+
+import pandas as pd
+
+# 允许的分隔符（多条码情况下取第一个）
+SEPS = [",", "，", ";", "；", " ", "\n", "\t", "/", "／", "|", "丨"]
+# 供整列正则使用的分隔符字符集
+_SEP_CLASS = re.escape("".join(SEPS))
+
+# 预编译的正则
+_FIRST_TOKEN = re.compile(f"[^{_SEP_CLASS}]+")
+_NUM6 = re.compile(r"\d{6,}")
+_NONDIGIT = re.compile(r"\D")
+_SPACES = re.compile(r"\s+")
+
+
+def _fallback_excel(path) -> pd.ExcelFile:
+    # openpyxl 只支持 xlsx/xlsm；旧版 .xls 交给 pandas 默认引擎
+    if str(path).lower().endswith(".xls"):
+        return pd.ExcelFile(path)
+    return pd.ExcelFile(path, engine="openpyxl")
+
+
+def open_excel(path) -> pd.ExcelFile:
+    """打开工作簿：优先 calamine 引擎（Rust 实现，解析更快），未安装或打不开时回退 openpyxl"""
+    try:
+        return pd.ExcelFile(path, engine="calamine")
+    except Exception:
+        return _fallback_excel(path)
+
+
+def parse_sheet(xl: pd.ExcelFile, sheet, **kwargs) -> pd.DataFrame:
+    """解析工作表；calamine 解析失败时用 openpyxl 重新打开工作簿，按相同参数再解析一次"""
+    try:
+        return xl.parse(sheet, **kwargs)
+    except Exception:
+        if xl.engine != "calamine":
+            raise
+        with _fallback_excel(xl.io) as fallback:
+            return fallback.parse(sheet, **kwargs)
+
+
+def excel_writer(path) -> pd.ExcelWriter:
+    """写出工作簿：优先 xlsxwriter（编码更快），未安装时回退 openpyxl"""
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return pd.ExcelWriter(path, engine="openpyxl")
+    # 条码等文本原样写出，不自动转数字/超链接
+    return pd.ExcelWriter(path, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}})
+
+
+def first_token(s: str) -> str:
+    """按常见分隔符切分，取第一个非空 token"""
+    if s is None:
+        return ""
+    # 先去首尾空白：\r、全角空格等不在 SEPS 中，不去掉会让开头就是分隔符时取不到 token
+    m = _FIRST_TOKEN.search(str(s).strip())
+    return m.group(0).strip() if m else ""
+
+
+def sanitize_barcode(raw) -> str:
+    """
+    清洗为条码字符串：
+      - 先取第一个 token
+      - 去尾部 .0
+      - 若含非数字，尝试提取第一个 6 位以上数字串；失败则仅保留所有数字
+    """
+    if pd.isna(raw):
+        return ""
+    s = first_token(str(raw))
+
+    if s.endswith(".0"):
+        s = s[:-2]
+
+    if not s.isdigit():
+        m = _NUM6.search(s)
+        if m:
+            s = m.group(0)
+
+    s = _NONDIGIT.sub("", s)
+    return s
+
+
+def vec_sanitize_barcode(series: pd.Series) -> pd.Series:
+    """sanitize_barcode 的整列版本（返回 object 列，缺失值为空串）"""
+    s = series.astype("string").str.strip()
+    tok = s.str.extract(f"({_FIRST_TOKEN.pattern})", expand=False).astype("string").fillna("").str.strip()
+    tok = tok.str.replace(r"\.0$", "", regex=True)
+
+    is_digit = tok.str.isdigit()
+    long_digits = tok.str.extract(f"({_NUM6.pattern})", expand=False).astype("string")
+    fallback = long_digits.fillna(tok.str.replace(_NONDIGIT, "", regex=True))
+    out = tok.where(is_digit, fallback)
+    return out.str.replace(_NONDIGIT, "", regex=True).astype(object)
+
+
+def vec_normalize_name(series: pd.Series) -> pd.Series:
+    """名称去首尾空白，连续空白合并为一个空格（返回 object 列，缺失值为空串）"""
+    s = series.astype("string").str.strip().str.replace(_SPACES, " ", regex=True)
+    return s.fillna("").astype(object)